@@ -1,15 +1,122 @@
 #!/usr/bin/env python3
 """
 Helper script for annotating invoice logos using labelImg
+
+With --prelabel, the current detector first runs over the annotation folder and writes
+YOLO-format proposals (<image stem>.txt, class 0, as add_invoices.py expects) next to each
+image, plus review_order.txt ranking images by detection uncertainty, so annotation becomes
+correcting proposals, hardest images first.
+
+Proposal files are recorded in proposals.json with the mtime they were written at. Saving an
+image in labelImg changes that mtime, which marks the label as reviewed; re-running --prelabel
+(e.g. with a retrained detector) replaces only the proposals nobody has saved since, and
+pages without any proposal get no .txt at all, so they stay unlabeled until reviewed.
 """
 
 import os
 import sys
+import json
+import argparse
 import subprocess
 from pathlib import Path
 
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+CONF_WRITE = 0.25   # proposals at/above this go into the .txt files
+CONF_LOW   = 0.05   # weaker candidates only feed the uncertainty score
+
+def uncertainty(confs, n_written):
+    """0 = model is sure, 1 = coin flip. A page with no written proposal is most uncertain,
+    since nearly every invoice carries a logo the model may have missed."""
+    if n_written == 0:
+        return 1.0
+    return max(1.0 - abs(2.0 * float(c) - 1.0) for c in confs)
+
+def _read_order(order_file):
+    """{image name: (u, n)} from an existing review_order.txt."""
+    if not order_file.exists():
+        return {}
+    prev = {}
+    for line in order_file.read_text().splitlines():
+        u, n, name = line.split("\t", 2)
+        prev[name] = (float(u), int(n))
+    return prev
+
+def _is_proposal(txt, proposals):
+    """True if ``txt`` is still the unreviewed proposal prelabel() wrote."""
+    return txt.name in proposals and txt.exists() and txt.stat().st_mtime_ns == proposals[txt.name]
+
+def prelabel(images_dir, weights, batch=8, overwrite=False, conf_write=CONF_WRITE, conf_low=CONF_LOW):
+    """Write detector proposals as YOLO .txt files next to each image; return the review ranking."""
+    from ultralytics import YOLO
+    from detect_and_identify import INF_IMGSZ, IOU_THRES
+    from image_io import load_page
+    from rect_infer import predict_rect
+
+    model = YOLO(str(weights))
+    images = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in IMG_EXTS)
+    prop_file = Path(images_dir) / "proposals.json"
+    old = json.loads(prop_file.read_text()) if prop_file.exists() else {}
+    todo = [p for p in images if overwrite or not p.with_suffix(".txt").exists()
+            or _is_proposal(p.with_suffix(".txt"), old)]
+    print(f"Pre-labeling {len(todo)} of {len(images)} images "
+          f"({len(images) - len(todo)} already reviewed, kept)")
+    # only still-unreviewed proposals of pages not redone this run stay recorded
+    proposals = {k: v for k, v in old.items() if _is_proposal(Path(images_dir) / k, old)}
+
+    ranking = []
+    for k in range(0, len(todo), batch):
+        chunk = todo[k:k + batch]
+        pages = [load_page(p) for p in chunk]
+        inputs, shapes = [], []
+        for page in pages:
+            inp, _ = page.inference_input(INF_IMGSZ)
+            inputs.append(inp)
+            shapes.append(inp.shape[:2])
+            page.release()   # labels are normalized, the inference copy is all we need
+        results = predict_rect(model, inputs, INF_IMGSZ, batch, conf=conf_low, iou=IOU_THRES)
+        for p, (h, w), r in zip(chunk, shapes, results):
+            xyxy = r.boxes.xyxy.cpu().numpy()
+            confs = r.boxes.conf.cpu().numpy()
+            lines = []
+            for (x1, y1, x2, y2), c in zip(xyxy, confs):
+                if c < conf_write:
+                    continue
+                cx, cy = (x1 + x2) / 2 / w, (y1 + y2) / 2 / h
+                lines.append(f"0 {cx:.6f} {cy:.6f} {(x2 - x1) / w:.6f} {(y2 - y1) / h:.6f}\n")
+            txt = p.with_suffix(".txt")
+            proposals.pop(txt.name, None)
+            if lines:
+                with open(txt, "w") as f:
+                    f.writelines(lines)
+                proposals[txt.name] = txt.stat().st_mtime_ns
+            elif txt.exists():   # stale proposal (or, with --overwrite, a label) of a page now empty
+                txt.unlink()
+            ranking.append((uncertainty(confs, len(lines)), len(lines), p))
+        print(f"  {min(k + batch, len(todo))}/{len(todo)}")
+        prop_file.write_text(json.dumps(proposals, indent=1))   # per chunk: survives an interrupted run
+
+    # keep earlier scores for pages not re-labeled this run, so the file still covers them
+    order_file = Path(images_dir) / "review_order.txt"
+    done = {p.name for _, _, p in ranking}
+    prev = _read_order(order_file)
+    ranking += [(*prev[p.name], p) for p in images if p.name in prev and p.name not in done]
+    ranking.sort(key=lambda t: t[0], reverse=True)
+    with open(order_file, "w") as f:
+        for u, n, p in ranking:
+            f.write(f"{u:.3f}\t{n}\t{p.name}\n")
+    print(f"Review order (most uncertain first) written to {order_file}")
+    for u, n, p in ranking[:10]:
+        print(f"  {u:.3f}  {n} box(es)  {p.name}")
+    return ranking
+
 def main():
     """Launch labelImg for invoice annotation"""
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--prelabel", action="store_true", help="write model proposals before launching labelImg")
+    ap.add_argument("--weights", default="runs/detect/train/weights/best.pt")
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--overwrite", action="store_true", help="also replace labels already reviewed in labelImg")
+    args = ap.parse_args()
     
     # Paths
     project_root = Path("/root/colander_image_extraction")
@@ -25,6 +132,14 @@ def main():
         for logo_class in logo_classes:
             f.write(f"{logo_class}\n")
     
+    if args.prelabel:
+        prelabel(images_dir, project_root / args.weights, args.batch, args.overwrite)
+        # labelImg reads the class list for YOLO files from classes.txt in the image folder
+        with open(images_dir / "classes.txt", "w") as f:
+            for logo_class in logo_classes:
+                f.write(f"{logo_class}\n")
+        print()
+    
     print("=" * 60)
     print("INVOICE LOGO ANNOTATION SETUP")
     print("=" * 60)
@@ -34,7 +149,11 @@ def main():
     print()
     print("INSTRUCTIONS:")
     print("1. LabelImg will open with your invoice images")
-    print("2. For each image:")
+    if args.prelabel:
+        print("2. Proposals are pre-filled; review images in review_order.txt order:")
+        print("   - Fix, delete or add boxes where the model got it wrong")
+        print("   - Click 'Save' (or press Ctrl+S) even if nothing changed; this marks it reviewed")
+    print("2. For each image:" if not args.prelabel else "   For images without proposals:")
     print("   - Click 'Create RectBox' (or press 'w')")
     print("   - Draw bounding box around each logo")
     print("   - Select appropriate class from dropdown")
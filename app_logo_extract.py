@@ -1,12 +1,13 @@
 import streamlit as st
 from pathlib import Path
 from ultralytics import YOLO
-from PIL import Image, ImageOps
-import numpy as np
-import cv2
+from image_io import MEM_BUDGET_MB, load_page
+from pipeline_metrics import get_metrics
+from rect_infer import model_stride, rect_shape
 
 # Path to your trained model
 MODEL_PATH = Path("runs/detect/train2/weights/best.pt")
+IMGSZ = 1024
 
 # Load YOLO model
 @st.cache_resource
@@ -15,20 +16,12 @@ def load_model():
 
 model = load_model()
 
-# --- Functions ---
-def exif_upright(pil_img: Image.Image) -> Image.Image:
-    """Correct orientation based on EXIF."""
-    return ImageOps.exif_transpose(pil_img)
+# Metrics (off unless LOGO_METRICS=1); cached so reruns share one registry / HTTP endpoint
+@st.cache_resource
+def load_metrics():
+    return get_metrics()
 
-def crop_with_pad(image_np, xyxy, pad=8):
-    """Crop logo with padding."""
-    h, w = image_np.shape[:2]
-    x1, y1, x2, y2 = map(int, xyxy)
-    x1 = max(0, x1 - pad)
-    y1 = max(0, y1 - pad)
-    x2 = min(w, x2 + pad)
-    y2 = min(h, y2 + pad)
-    return image_np[y1:y2, x1:x2]
+metrics = load_metrics()
 
 # --- Streamlit UI ---
 st.title("📄 Logo Extractor from Invoice")
@@ -37,31 +30,40 @@ st.write("Upload an invoice and the model will detect and extract the logo.")
 uploaded_file = st.file_uploader("Upload invoice image", type=["jpg", "jpeg", "png"])
 
 if uploaded_file:
-    pil_img = Image.open(uploaded_file)
-    pil_img = exif_upright(pil_img)
-    img_np = np.array(pil_img)
+    with metrics.request(source=uploaded_file.name):
+        metrics.inc("images")
+        # one decoded BGR buffer; orientation is a view, the model gets a small copy
+        with metrics.stage("decode"):
+            page = load_page(uploaded_file.getvalue(), MEM_BUDGET_MB)
+        with metrics.stage("resize"):
+            img_small, (fx, fy) = page.inference_input(IMGSZ)
 
-    # Run YOLO detection
-    results = model.predict(
-        source=img_np,
-        conf=0.25,
-        iou=0.45,
-        imgsz=1024,
-        verbose=False
-    )
+        # Run YOLO detection
+        with metrics.stage("inference"):
+            results = model.predict(
+                source=img_small,
+                conf=0.25,
+                iou=0.45,
+                imgsz=list(rect_shape(*img_small.shape[:2], IMGSZ, model_stride(model))),
+                verbose=False
+            )
 
-    # Draw results and crop logo
-    if len(results) > 0 and len(results[0].boxes) > 0:
-        st.subheader("Original Invoice:")
-        st.image(pil_img, caption="Uploaded Invoice", use_column_width=True)
+        # Draw results and crop logo
+        if len(results) > 0 and len(results[0].boxes) > 0:
+            metrics.inc("boxes", len(results[0].boxes))
+            st.subheader("Original Invoice:")
+            # the display is width-limited anyway, so show the inference-size copy
+            st.image(img_small, channels="BGR", caption="Uploaded Invoice", use_column_width=True)
 
-        for i, box in enumerate(results[0].boxes):
-            xyxy = box.xyxy[0].cpu().numpy()
-            crop_np = crop_with_pad(img_np, xyxy, pad=8)
-            crop_pil = Image.fromarray(crop_np)
+            for i, box in enumerate(results[0].boxes):
+                xyxy = box.xyxy[0].cpu().numpy() * (fx, fy, fx, fy)
+                with metrics.stage("crop"):
+                    crop_np = page.crop(xyxy, pad=8)
 
-            st.subheader(f"Extracted Logo #{i+1}")
-            st.image(crop_pil, use_column_width=False)
+                st.subheader(f"Extracted Logo #{i+1}")
+                st.image(crop_np, channels="BGR", use_column_width=False)
 
-    else:
-        st.warning("No logo detected in the image.")
\ No newline at end of file
+        else:
+            metrics.inc("no_detection")
+            st.warning("No logo detected in the image.")
+        del page, img_small
@@ -0,0 +1,251 @@
+# autotune_train.py
+# Pick dataloader workers / batch size / cache mode for CPU training by measuring them.
+#
+# Stages:
+#   1. dataloader throughput (images/s) for every (cache, workers) pair on a small subset
+#   2. forward+backward compute throughput (images/s) for every batch size
+#   3. end-to-end confirmation of the best predicted configs (loader + compute together,
+#      since on CPU both compete for the same cores), with peak memory growth checked against
+#      the machine's memory budget
+# The fastest config that fits wins; if none of the measured ones fits, the caller keeps its
+# defaults. Everything measured is written to autotune.json.
+#
+# Timings are steady-state: after the warm-up batch the loader's prefetch queue
+# (workers x prefetch_factor batches, built while workers spin up) is drained untimed, and
+# only batches produced after that are counted. Worker counts the loader clamps to the same
+# effective value are measured once.
+
+import json, os, random, shutil, time
+from pathlib import Path
+
+import cv2
+import psutil
+import torch
+from ultralytics import YOLO
+from ultralytics.cfg import get_cfg
+from ultralytics.data import build_dataloader, build_yolo_dataset
+from ultralytics.data.utils import check_det_dataset
+from ultralytics.utils import DEFAULT_CFG
+
+from pipeline_metrics import PeakRSS
+
+BATCH_CANDIDATES = (8, 16, 32)
+CACHE_CANDIDATES = ("ram", "disk", False)
+SUBSET_IMAGES    = 256     # images used for the loader / end-to-end trials (at least, see below)
+LOADER_BATCHES   = 16      # batches timed per loader trial (after warm-up + prefetch drain)
+COMPUTE_STEPS    = 3       # steps timed per compute trial (after 1 warm-up)
+E2E_STEPS        = 6       # steps timed per end-to-end trial (after warm-up + prefetch drain)
+TOP_K            = 3       # fitting configs confirmed end-to-end
+MAX_E2E_TRIALS   = 9       # stop walking down the prediction list after this many trials
+MEM_FRACTION     = 0.80    # share of currently available RAM we allow ourselves
+SIZE_SAMPLES     = 30      # images sampled to estimate cache size
+
+def worker_candidates():
+    n = os.cpu_count() or 1
+    out, w = [0], 2
+    while w <= n:
+        out.append(w)
+        w *= 2
+    return out
+
+def make_cfg(data_yaml, imgsz, cache, fraction):
+    return get_cfg(DEFAULT_CFG, dict(data=data_yaml, imgsz=imgsz, cache=cache, fraction=fraction))
+
+def estimate_cache_bytes(im_files, imgsz):
+    """Bytes needed to hold every image resized to imgsz (what ram/disk caching stores)."""
+    sample = random.sample(im_files, min(SIZE_SAMPLES, len(im_files)))
+    total, n = 0, 0
+    for f in sample:
+        im = cv2.imread(f)
+        if im is None:
+            continue
+        h, w = im.shape[:2]
+        r = imgsz / max(h, w)
+        total += h * w * 3 * r * r
+        n += 1
+    return int(total / max(n, 1) * len(im_files))
+
+def _batches(loader):
+    """Endless batch stream; the ultralytics loader repeats its sampler, so workers persist."""
+    while True:
+        yield from loader
+
+def _steady(loader):
+    """Batch iterator past warm-up, with the batches prefetched meanwhile already consumed."""
+    it = _batches(loader)
+    next(it)  # warm-up: spawns workers, which start filling the prefetch queue
+    for _ in range(loader.num_workers * (loader.prefetch_factor or 0)):
+        next(it)
+    return it
+
+def time_loader(loader, n_batches):
+    it = _steady(loader)
+    n, t0 = 0, time.perf_counter()
+    for _ in range(n_batches):
+        n += len(next(it)["img"])
+    dt = time.perf_counter() - t0
+    return n / dt if dt > 0 else 0.0
+
+def train_step(net, opt, batch):
+    batch["img"] = batch["img"].float() / 255
+    loss = net.loss(batch)[0]
+    if loss.dim() > 0:
+        loss = loss.sum()
+    opt.zero_grad()
+    loss.backward()
+    opt.step()
+
+def profiling_model(weights, cfg):
+    net = YOLO(weights).model
+    net.args = cfg   # loss hyper-parameters (box/cls/dfl)
+    net.train()
+    for p in net.parameters():
+        p.requires_grad = True
+    opt = torch.optim.SGD(net.parameters(), lr=1e-4, momentum=0.9)
+    return net, opt
+
+def time_compute(net, opt, batch_size, imgsz, steps):
+    def fake_batch():
+        n_obj = batch_size  # one box per image is enough to exercise the loss
+        return {
+            "img": torch.randint(0, 255, (batch_size, 3, imgsz, imgsz), dtype=torch.uint8),
+            "batch_idx": torch.arange(n_obj, dtype=torch.float32),
+            "cls": torch.zeros(n_obj, 1),
+            "bboxes": torch.tensor([[0.5, 0.5, 0.2, 0.1]]).repeat(n_obj, 1),
+        }
+    train_step(net, opt, fake_batch())
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        train_step(net, opt, fake_batch())
+    dt = time.perf_counter() - t0
+    return batch_size * steps / dt if dt > 0 else 0.0
+
+def time_end_to_end(net, opt, loader, steps):
+    it = _steady(loader)
+    train_step(net, opt, next(it))
+    n, t0 = 0, time.perf_counter()
+    for _ in range(steps):
+        batch = next(it)
+        n += len(batch["img"])
+        train_step(net, opt, batch)
+    dt = time.perf_counter() - t0
+    return n / dt if dt > 0 else 0.0
+
+def autotune(data_yaml, weights="yolov8n.pt", imgsz=1024, verbose=True):
+    """Measure candidate (workers, batch, cache) configs and return the fastest one that fits.
+
+    Returns a dict with the chosen ``workers``/``batch``/``cache`` (all None if no measured
+    config fits the memory budget) plus every measurement, ready to be passed to ``save_report``.
+    """
+    log = print if verbose else (lambda *a, **k: None)
+    data = check_det_dataset(data_yaml)
+    mem_budget = int(psutil.virtual_memory().available * MEM_FRACTION)
+    rss0 = psutil.Process().memory_info().rss   # already used, so not part of the budget
+
+    full = build_yolo_dataset(make_cfg(data_yaml, imgsz, False, 1.0), data["train"], max(BATCH_CANDIDATES), data)
+    n_total = len(full)
+    cache_bytes = estimate_cache_bytes(full.im_files, imgsz)
+    disk_free = shutil.disk_usage(Path(full.im_files[0]).parent).free
+    # enough batches that the loader does not clamp the larger worker counts to the batch count
+    subset = max(SUBSET_IMAGES, max(worker_candidates()) * max(BATCH_CANDIDATES))
+    fraction = min(1.0, subset / max(n_total, 1))
+    del full
+    log(f"[Autotune] {n_total} train images | cache estimate {cache_bytes/2**30:.2f} GB "
+        f"| RAM budget {mem_budget/2**30:.2f} GB | disk free {disk_free/2**30:.2f} GB")
+
+    caches = []
+    for c in CACHE_CANDIDATES:
+        if c == "ram" and cache_bytes > mem_budget:
+            log("[Autotune] skip cache=ram (dataset does not fit the RAM budget)")
+        elif c == "disk" and cache_bytes > disk_free:
+            log("[Autotune] skip cache=disk (not enough free disk)")
+        else:
+            caches.append(c)
+
+    # ---- 1. dataloader throughput ----
+    loader_ips, datasets = {}, {}
+    for c in caches:
+        datasets[c] = build_yolo_dataset(make_cfg(data_yaml, imgsz, c, fraction), data["train"],
+                                         max(BATCH_CANDIDATES), data)
+        for w in worker_candidates():
+            loader = build_dataloader(datasets[c], max(BATCH_CANDIDATES), w, shuffle=True)
+            if loader.num_workers != w:   # clamped by CPU / batch count: same as a smaller count
+                log(f"[Autotune] skip cache={c} workers={w} (loader would run {loader.num_workers})")
+                del loader
+                continue
+            loader_ips[(c, w)] = time_loader(loader, LOADER_BATCHES)
+            del loader
+            log(f"[Autotune] loader cache={c} workers={w}: {loader_ips[(c, w)]:.1f} img/s")
+
+    # ---- 2. compute throughput ----
+    cfg = make_cfg(data_yaml, imgsz, False, fraction)
+    net, opt = profiling_model(weights, cfg)
+    compute_ips = {}
+    for b in BATCH_CANDIDATES:
+        try:
+            compute_ips[b] = time_compute(net, opt, b, imgsz, COMPUTE_STEPS)
+        except RuntimeError as e:  # typically out of memory
+            log(f"[Autotune] batch={b} failed: {e}")
+            break
+        log(f"[Autotune] compute batch={b}: {compute_ips[b]:.1f} img/s")
+
+    # ---- 3. end-to-end on the best predicted configs ----
+    predicted = sorted(
+        ((min(loader_ips[(c, w)], compute_ips[b]), c, w, b)
+         for (c, w) in loader_ips for b in compute_ips),
+        key=lambda t: t[0], reverse=True)
+    trials = []
+    for pred, c, w, b in predicted:
+        if sum(t["fits"] for t in trials) >= TOP_K or len(trials) >= MAX_E2E_TRIALS:
+            break
+        loader = build_dataloader(datasets[c], b, w, shuffle=True)
+        if loader.num_workers != w:   # a smaller batch can clamp workers: not the config predicted
+            del loader
+            continue
+        with PeakRSS() as rss:
+            ips = time_end_to_end(net, opt, loader, E2E_STEPS)
+        del loader
+        # the subset is already cached inside the measured growth; add the rest of the dataset
+        projected = rss.peak - rss0 + (int(cache_bytes * (1 - fraction)) if c == "ram" else 0)
+        fits = projected <= mem_budget
+        trials.append(dict(cache=c, workers=w, batch=b, predicted_ips=pred, ips=ips,
+                           peak_rss=rss.peak, projected_rss=projected, fits=fits))
+        log(f"[Autotune] e2e cache={c} workers={w} batch={b}: {ips:.1f} img/s "
+            f"| projected memory {projected/2**30:.2f} GB{'' if fits else ' (over budget)'}")
+    del datasets, net, opt
+
+    fitting = [t for t in trials if t["fits"]]
+    if fitting:
+        best = max(fitting, key=lambda t: t["ips"])
+        log(f"[Autotune] chosen: cache={best['cache']} workers={best['workers']} batch={best['batch']} "
+            f"({best['ips']:.1f} img/s)")
+    else:
+        best = dict(workers=None, batch=None, cache=None, ips=None)
+        log("[Autotune] no measured config fits the memory budget; keeping the defaults")
+
+    return dict(
+        workers=best["workers"], batch=best["batch"], cache=best["cache"], images_per_s=best["ips"],
+        imgsz=imgsz, n_train_images=n_total, subset_images=round(n_total * fraction),
+        mem_budget=mem_budget, cache_bytes_estimate=cache_bytes, disk_free=disk_free,
+        cpu_count=os.cpu_count(), torch_threads=torch.get_num_threads(),
+        loader_ips=[dict(cache=c, workers=w, ips=v) for (c, w), v in loader_ips.items()],
+        compute_ips=[dict(batch=b, ips=v) for b, v in compute_ips.items()],
+        end_to_end=trials,
+    )
+
+def save_report(result, run_dir):
+    out = Path(run_dir) / "autotune.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2))
+    return out
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", default="yolo_logo.yaml")
+    ap.add_argument("--weights", default="yolov8n.pt")
+    ap.add_argument("--imgsz", type=int, default=1024)
+    ap.add_argument("--out", default=".")
+    args = ap.parse_args()
+    res = autotune(args.data, args.weights, args.imgsz)
+    print(f"Saved {save_report(res, args.out)}")
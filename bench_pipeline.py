@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark detect_and_identify over a set of pages: latency and peak RSS per request
+"""
+
+import argparse, glob, json, statistics, tempfile, time
+from pathlib import Path
+
+import psutil
+from ultralytics import YOLO
+
+from crop_cache import CropCache
+from detect_and_identify import load_gallery, process_image
+from image_io import MEM_BUDGET_MB
+from pipeline_metrics import PeakRSS
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("images", nargs="+", help="image files or glob patterns")
+    ap.add_argument("--weights", default="runs/detect/train/weights/best.pt")
+    ap.add_argument("--logos", default="logos")
+    ap.add_argument("--out", default=None, help="crop output dir (default: temp dir)")
+    ap.add_argument("--mem-budget-mb", type=int, default=MEM_BUDGET_MB)
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--crop-cache", action="store_true", help="memoize crop identities by perceptual hash")
+    ap.add_argument("--cache-db", default=None, help="sqlite file for the crop cache's disk tier")
+    ap.add_argument("--json", default=None, help="write per-request results here")
+    args = ap.parse_args()
+
+    paths = [p for pat in args.images for p in (sorted(glob.glob(pat)) or [pat])]
+    out_dir = args.out or tempfile.mkdtemp(prefix="bench_")
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    model = YOLO(args.weights)
+    gallery, orb = load_gallery(args.logos)
+    cache = CropCache(disk_path=args.cache_db) if (args.crop_cache or args.cache_db) else None
+    if paths:  # warm-up so model init does not land on the first request (and not in the cache)
+        process_image(paths[0], model, gallery, orb, out_dir, args.mem_budget_mb)
+
+    rows = []
+    for _ in range(args.repeat):
+        for p in paths:
+            base = psutil.Process().memory_info().rss
+            with PeakRSS(interval=0.01) as rss:
+                t0 = time.perf_counter()
+                saved = process_image(p, model, gallery, orb, out_dir, args.mem_budget_mb, cache)
+                dt = time.perf_counter() - t0
+            rows.append(dict(image=p, seconds=dt, peak_rss=rss.peak, request_rss=rss.peak - base,
+                             crops=len(saved)))
+            print(f"{Path(p).name:40s} {dt*1000:8.1f} ms  peak {rss.peak/2**20:8.1f} MB  "
+                  f"(+{(rss.peak - base)/2**20:.1f} MB for this request)")
+
+    if rows:
+        lat = [r["seconds"] for r in rows]
+        req = [r["request_rss"] for r in rows]
+        print("-" * 60)
+        print(f"requests: {len(rows)} | latency p50 {pct(lat, .5)*1000:.1f} ms  p95 {pct(lat, .95)*1000:.1f} ms "
+              f"| mean {statistics.mean(lat)*1000:.1f} ms")
+        if cache is not None:
+            print(f"crop cache: {cache.hits} hits / {cache.misses} misses")
+        print(f"per-request RSS p50 {pct(req, .5)/2**20:.1f} MB  max {max(req)/2**20:.1f} MB "
+              f"| process peak {max(r['peak_rss'] for r in rows)/2**20:.1f} MB")
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, indent=2))
+
+if __name__ == "__main__":
+    main()
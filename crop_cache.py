@@ -0,0 +1,178 @@
+# crop_cache.py
+# Memoize crop -> (logo name, score) across invoices, keyed by a perceptual hash.
+#
+# The same vendor logo shows up on thousands of invoices; a 64-bit DCT pHash of the
+# normalized crop is stable across re-scans, small shifts from box jitter and scale, so a
+# Hamming-radius lookup lets repeat vendors skip ORB detectAndCompute and gallery matching.
+#
+# Radius queries use multi-index hashing: the 64 bits are split into radius+1 bands, and by
+# pigeonhole any hash within the radius agrees exactly on at least one band. Each band has an
+# exact-match index (dict in memory, indexed column on disk), so lookups stay O(candidates).
+#
+# Tiers: in-memory LRU, then an optional sqlite file. Entries are tagged with a fingerprint
+# of the gallery; when the gallery changes the memory tier is dropped and disk rows from
+# other gallery versions are ignored (and pruned).
+
+import hashlib, sqlite3, threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+HASH_BITS      = 64
+DEFAULT_RADIUS = 6
+DEFAULT_SIZE   = 4096
+
+def phash(crop_bgr):
+    """64-bit DCT perceptual hash of a BGR (or gray) crop."""
+    gray = crop_bgr if crop_bgr.ndim == 2 else cv2.cvtColor(crop_bgr, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low[1:] > np.median(low[1:])   # skip DC: it only encodes overall brightness
+    return int.from_bytes(np.packbits(np.concatenate(([False], bits))).tobytes(), "big")
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def _bands(radius):
+    """(shift, mask) for radius+1 bands covering all 64 bits."""
+    k = radius + 1
+    edges = [round(i * HASH_BITS / k) for i in range(k + 1)]
+    return [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+
+_last = (None, (), None)   # (gallery, its (name, des) objects, fingerprint)
+
+def gallery_fingerprint(gallery):
+    """Content hash of a gallery [(name, img, des), ...]; memoized while entries are unchanged.
+
+    The memo holds the gallery and its entries themselves (not their ids), so a freed
+    gallery can never be mistaken for a new one that reuses its addresses.
+    """
+    global _last
+    entries = tuple((name, des) for name, _, des in gallery)
+    g, prev, fp = _last
+    if g is gallery and len(prev) == len(entries) and all(
+            a[0] == b[0] and a[1] is b[1] for a, b in zip(prev, entries)):
+        return fp
+    h = hashlib.sha1()
+    for name, des in sorted(entries, key=lambda e: e[0]):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(des).tobytes())
+    fp = h.hexdigest()
+    _last = (gallery, entries, fp)
+    return fp
+
+class CropCache:
+    """LRU of pHash -> (name, score) with Hamming-radius lookup and an optional sqlite tier."""
+    def __init__(self, max_size=DEFAULT_SIZE, radius=DEFAULT_RADIUS, disk_path=None):
+        self.max_size = max_size
+        self.radius = radius
+        self.bands = _bands(radius)
+        self.version = None
+        self.hits = self.misses = 0
+        self._lru = OrderedDict()                     # hash -> (name, score)
+        self._index = [dict() for _ in self.bands]    # band value -> set of hashes
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(str(disk_path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            cols = ", ".join(f"b{i} INTEGER" for i in range(len(self.bands)))
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS crops (hash TEXT, version TEXT, name TEXT, "
+                             f"score REAL, {cols}, PRIMARY KEY (hash, version))")
+            for i in range(len(self.bands)):
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS crops_b{i} ON crops (version, b{i})")
+
+    def _band_values(self, h):
+        return [(h >> shift) & mask for shift, mask in self.bands]
+
+    # ---- memory tier ----
+    def _mem_add(self, h, value):
+        if h in self._lru:
+            self._lru.move_to_end(h)
+            self._lru[h] = value
+            return
+        self._lru[h] = value
+        for idx, b in zip(self._index, self._band_values(h)):
+            idx.setdefault(b, set()).add(h)
+        while len(self._lru) > self.max_size:
+            old, _ = self._lru.popitem(last=False)
+            for idx, b in zip(self._index, self._band_values(old)):
+                s = idx[b]
+                s.discard(old)
+                if not s:
+                    del idx[b]
+
+    def _mem_find(self, h):
+        best, best_d = None, self.radius + 1
+        for idx, b in zip(self._index, self._band_values(h)):
+            for cand in idx.get(b, ()):
+                d = hamming(h, cand)
+                if d < best_d:
+                    best, best_d = cand, d
+        if best is None:
+            return None
+        self._lru.move_to_end(best)
+        return self._lru[best]
+
+    # ---- disk tier ----
+    def _disk_find(self, h):
+        where = " OR ".join(f"b{i} = ?" for i in range(len(self.bands)))
+        rows = self._db.execute(f"SELECT hash, name, score FROM crops WHERE version = ? AND ({where})",
+                                (self.version, *self._band_values(h))).fetchall()
+        best, best_d = None, self.radius + 1
+        for hx, name, score in rows:
+            d = hamming(h, int(hx, 16))
+            if d < best_d:
+                best, best_d = (int(hx, 16), (name, score)), d
+        return best
+
+    def _disk_put(self, h, value):
+        cols = ", ".join(f"b{i}" for i in range(len(self.bands)))
+        marks = ", ".join("?" * len(self.bands))
+        self._db.execute(f"INSERT OR REPLACE INTO crops (hash, version, name, score, {cols}) "
+                         f"VALUES (?, ?, ?, ?, {marks})",
+                         (f"{h:016x}", self.version, value[0], value[1], *self._band_values(h)))
+
+    # ---- public ----
+    def bind(self, version):
+        """Switch to a gallery version; drops memory entries and stale disk rows if it changed."""
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self._lru.clear()
+            for idx in self._index:
+                idx.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM crops WHERE version != ?", (version,))
+
+    def get(self, h):
+        """(name, score) cached for a hash within ``radius`` bits of ``h``, else None."""
+        with self._lock:
+            hit = self._mem_find(h)
+            if hit is None and self._db is not None:
+                found = self._disk_find(h)
+                if found is not None:
+                    self._mem_add(*found)
+                    hit = found[1]
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return hit
+
+    def put(self, h, name, score):
+        with self._lock:
+            self._mem_add(h, (name, score))
+            if self._db is not None:
+                self._disk_put(h, (name, score))
+
+    def __len__(self):
+        return len(self._lru)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
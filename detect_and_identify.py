@@ -1,43 +1,53 @@
-import os, glob
+import time
 from pathlib import Path
 import cv2
-import numpy as np
-from PIL import Image, ImageOps
 from ultralytics import YOLO
+from crop_cache import CropCache, gallery_fingerprint, phash
+from image_io import MEM_BUDGET_MB, decoded_nbytes, load_page, page_shape
+from logo_gallery import ORB_FEATURES, LogoGallery, load_logo
+from pipeline_metrics import get_metrics
+from rect_infer import predict_rect, rect_shape
 
 CONF_THRES = 0.25
 IOU_THRES  = 0.45
 PAD        = 8
-
-def exif_fix(pil):
-    return ImageOps.exif_transpose(pil)
-
-def crop_pad(bgr, box, pad=8):
-    h, w = bgr.shape[:2]
-    x1, y1, x2, y2 = map(int, box)
-    x1 = max(0, x1-pad); y1 = max(0, y1-pad)
-    x2 = min(w, x2+pad); y2 = min(h, y2+pad)
-    return bgr[y1:y2, x1:x2]
+INF_IMGSZ  = 1280
+INF_BATCH  = 8
+RECT_INFER = True    # batch pages by stride-aligned rectangular shape (mixed-shape batches would be squared)
 
 def load_gallery(logos_dir):
-    """Load clean logos and precompute ORB descriptors."""
-    orb = cv2.ORB_create(nfeatures=1500)
+    """Load clean logos and precompute ORB descriptors (static; see LogoGallery for hot reload)."""
+    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
     gallery = []
     for p in sorted(Path(logos_dir).glob("*")):
-        img = Image.open(p).convert("RGB")
-        img = exif_fix(img)
-        g = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-        ggray = cv2.cvtColor(g, cv2.COLOR_BGR2GRAY)
-        kps, des = orb.detectAndCompute(ggray, None)
-        if des is not None:
-            gallery.append((p.name, g, des))
+        entry = load_logo(p, orb)
+        if entry is not None:
+            gallery.append(entry)
     if not gallery:
         raise RuntimeError("No valid logos in gallery")
     return gallery, orb
 
-def identify_logo(crop_bgr, gallery, orb):
-    """Return best-matching gallery filename and a score (higher is better)."""
+def identify_logo(crop_bgr, gallery, orb, cache=None):
+    """Return best-matching gallery filename and a score (higher is better).
+
+    With a CropCache, crops whose perceptual hash is within the cache radius of an already
+    identified crop reuse that answer and skip ORB extraction + matching entirely.
+    """
     gray = cv2.cvtColor(crop_bgr, cv2.COLOR_BGR2GRAY)
+    if cache is not None:
+        cache.bind(getattr(gallery, "version", None) or gallery_fingerprint(gallery))
+        h = phash(gray)
+        hit = cache.get(h)
+        if hit is not None:
+            get_metrics().inc("cache_hits")
+            return hit
+        get_metrics().inc("cache_misses")
+    name, score = match_gallery(gray, gallery, orb)
+    if cache is not None:
+        cache.put(h, name, score)
+    return name, score
+
+def match_gallery(gray, gallery, orb):
     kps, des = orb.detectAndCompute(gray, None)
     if des is None or len(des) < 10:
         return None, 0.0
@@ -54,28 +64,177 @@ def identify_logo(crop_bgr, gallery, orb):
             best_name = name
     return best_name, float(best_score)
 
-def main(img_path, weights="runs/detect/train/weights/best.pt", logos_dir="logos", out_dir="out"):
+def _save_crops(img_path, page, boxes, confs, gallery, orb, out_dir, cache, store=None, timings=None):
+    m = get_metrics()
+    saved = []
+    if len(boxes) == 0:
+        m.inc("no_detection")
+        if store is not None:
+            store.add(img_path, timings=timings)
+        else:
+            print(f"No logo detected in {img_path}.")
+        return saved
+
+    m.inc("boxes", len(boxes))
+    crops = [page.crop(box, PAD) for box in boxes]
+    scale = page.scale
+    page.release()   # only the small crops are needed from here on
+    for i, (crop, box, conf) in enumerate(zip(crops, boxes, confs)):
+        t0 = time.perf_counter()
+        with m.stage("identify"):
+            name, score = identify_logo(crop, gallery, orb, cache)
+        if name is None:
+            m.inc("misses")
+        if store is not None:
+            with m.stage("write"):
+                cid = store.add(img_path, i, box * scale, conf, name, score, crop,
+                                dict(timings or {}, identify=time.perf_counter() - t0))
+            saved.append(((store.writer, cid), name, score))   # ids are per writer archive
+            continue
+        tag = name if name else f"candidate_{i+1}"
+        outp = Path(out_dir) / f"{Path(img_path).stem}_{tag}.png"
+        with m.stage("write"):
+            cv2.imwrite(str(outp), crop)
+        print(f"Saved {outp}  (match: {name}, score: {score:.2f})")
+        saved.append((outp, name, score))
+    return saved
+
+def _detect_group(group, model, gallery, orb, out_dir, cache, rect, batch, store):
+    """Inference over already-decoded pages [(path, page, inp, (fx, fy), t_dec, t_rs)], then crops."""
+    m = get_metrics()
+    inputs = [g[2] for g in group]
+    t0 = time.perf_counter()
+    if rect:
+        results = predict_rect(model, inputs, INF_IMGSZ, batch, conf=CONF_THRES, iou=IOU_THRES)
+    else:
+        results = [r for k in range(0, len(inputs), batch)
+                   for r in model(inputs[k:k + batch], conf=CONF_THRES, iou=IOU_THRES, imgsz=INF_IMGSZ, verbose=False)]
+    t_inf = (time.perf_counter() - t0) / len(inputs)
+    boxes = [r.boxes.xyxy.cpu().numpy() * (fx, fy, fx, fy) for r, (_, _, _, (fx, fy), _, _) in zip(results, group)]
+    confs = [r.boxes.conf.cpu().numpy() for r in results]
+    del inputs, results
+
+    out = {}
+    for (p, page, _, _, t_dec, t_rs), b, c in zip(group, boxes, confs):
+        with m.request(prior=t_dec + t_rs + t_inf, source=str(p)):
+            m.inc("images")
+            m.observe("decode", t_dec)
+            m.observe("resize", t_rs)
+            m.observe("inference", t_inf)
+            timings = dict(decode=t_dec, resize=t_rs, inference=t_inf)
+            out[str(p)] = _save_crops(p, page, b, c, gallery, orb, out_dir, cache, store, timings)
+    return out
+
+def process_batch(img_paths, model, gallery, orb, out_dir="out", mem_budget_mb=MEM_BUDGET_MB, cache=None,
+                  rect=RECT_INFER, batch=INF_BATCH, store=None, errors=None):
+    """Detect, identify and save logo crops for a few pages; returns {path: [(out_path, name, score)]}.
+
+    With a ResultStoreWriter as ``store``, crops go to its packed archive and each box becomes a
+    detection row (boxes in original-file pixels) instead of a PNG file plus a stdout line;
+    the returned entries then hold (crop_archive, crop_id) in place of paths, which is what
+    ResultStore.crop() takes.
+
+    Pages are decoded and held for a shared forward pass only while their decoded buffers,
+    plus the next page's decode peak, fit ``mem_budget_mb``; a page that would not fit first
+    flushes the pages held so far. So the budget bounds the whole batch, not each page. A
+    single page stays within it only if it is a JPEG: PNG/TIFF pages over budget are decoded
+    at full resolution before being shrunk (see image_io). With rect=True each page
+    is inferred at a stride-aligned rectangular shape matching its aspect ratio, and
+    same-shape pages share a forward pass.
+
+    ``gallery`` is a load_gallery() list or a LogoGallery; the latter is snapshotted once so
+    every page is matched against one consistent gallery version even if it reloads.
+
+    ``errors``: if a dict, pages that cannot be read or decoded are recorded there as
+    {path: message} and skipped instead of failing the whole batch.
+    """
+    if isinstance(gallery, LogoGallery):
+        gallery = gallery.snapshot()
+    budget = mem_budget_mb * 2**20
+    out, group, held = {}, [], 0
+    for p in img_paths:
+        try:
+            _, peak = decoded_nbytes(p, mem_budget_mb)
+        except (OSError, ValueError) as e:   # missing file or unreadable header
+            if errors is None:
+                raise
+            errors[str(p)] = f"{type(e).__name__}: {e}"
+            continue
+        if group and held + peak > budget:
+            out.update(_detect_group(group, model, gallery, orb, out_dir, cache, rect, batch, store))
+            group, held = [], 0
+        t0 = time.perf_counter()
+        try:
+            page = load_page(p, mem_budget_mb)
+        except (OSError, ValueError) as e:   # truncated or undecodable pixel data
+            if errors is None:
+                raise
+            errors[str(p)] = f"{type(e).__name__}: {e}"
+            continue
+        t1 = time.perf_counter()
+        inp, f = page.inference_input(INF_IMGSZ)
+        group.append((p, page, inp, f, t1 - t0, time.perf_counter() - t1))
+        held += page.nbytes
+    if group:
+        out.update(_detect_group(group, model, gallery, orb, out_dir, cache, rect, batch, store))
+    return out
+
+def process_image(img_path, model, gallery, orb, out_dir="out", mem_budget_mb=MEM_BUDGET_MB, cache=None,
+                  rect=RECT_INFER):
+    """Detect, identify and save logo crops for one page; returns [(out_path, name, score)]."""
+    return process_batch([img_path], model, gallery, orb, out_dir, mem_budget_mb, cache, rect)[str(img_path)]
+
+def main(img_path, weights="runs/detect/train/weights/best.pt", logos_dir="logos", out_dir="out",
+         mem_budget_mb=MEM_BUDGET_MB, cache_db=None, rect=RECT_INFER):
+    """cache_db: optional sqlite file for the crop-identity cache, shared across runs."""
     Path(out_dir).mkdir(parents=True, exist_ok=True)
     model = YOLO(weights)
     gallery, orb = load_gallery(logos_dir)
+    get_metrics().set_gauge("gallery_size", len(gallery))
+    cache = CropCache(disk_path=cache_db) if cache_db else None
+    try:
+        return process_image(img_path, model, gallery, orb, out_dir, mem_budget_mb, cache, rect)
+    finally:
+        if cache is not None:
+            cache.close()
 
-    pil = Image.open(img_path).convert("RGB")
-    pil = exif_fix(pil)
-    bgr = cv2.cvtColor(np.array(pil), cv2.COLOR_RGB2BGR)
+def run_batch(img_paths, weights="runs/detect/train/weights/best.pt", logos_dir="logos", out_dir="out",
+              mem_budget_mb=MEM_BUDGET_MB, cache_db=None, watch=True, rect=RECT_INFER, batch=INF_BATCH,
+              store_dir=None, crop_format="png"):
+    """Long-running variant of main(): one model, one crop cache, and (with watch=True) a
+    gallery that picks up added/replaced/removed logos without a restart.
 
-    res = model(bgr, conf=CONF_THRES, iou=IOU_THRES, imgsz=1280, verbose=False)[0]
-    if len(res.boxes) == 0:
-        print("No logo detected.")
-        return
-
-    for i, box in enumerate(res.boxes.xyxy.cpu().numpy()):
-        crop = crop_pad(bgr, box, PAD)
-        name, score = identify_logo(crop, gallery, orb)
-        tag = name if name else f"candidate_{i+1}"
-        outp = Path(out_dir) / f"{Path(img_path).stem}_{tag}.png"
-        cv2.imwrite(str(outp), crop)
-        print(f"Saved {outp}  (match: {name}, score: {score:.2f})")
+    store_dir: write detections to Parquet and crops to a packed archive there (see
+    result_store.py) instead of one PNG per crop; crop_format is "png", "jpg" or "raw".
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    model = YOLO(weights)
+    gallery = LogoGallery(logos_dir)
+    if watch:
+        gallery.start()
+    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+    cache = CropCache(disk_path=cache_db)
+    store = None
+    if store_dir:
+        from result_store import ResultStoreWriter   # pyarrow only needed for store runs
+        store = ResultStoreWriter(store_dir, crop_format=crop_format)
+    if rect:  # neighbours then share a shape bucket, so each chunk is one forward pass
+        img_paths = sorted(img_paths, key=lambda p: rect_shape(*page_shape(p), INF_IMGSZ))
+    results = {}
+    try:
+        for k in range(0, len(img_paths), batch):
+            results.update(process_batch(img_paths[k:k + batch], model, gallery, orb, out_dir,
+                                         mem_budget_mb, cache, rect, batch, store))
+    finally:
+        gallery.stop()
+        cache.close()
+        if store is not None:
+            store.close()
+    return results
 
 if __name__ == "__main__":
     import sys
-    main(sys.argv[1])
\ No newline at end of file
+    if len(sys.argv) > 2:
+        run_batch(sys.argv[1:])
+    else:
+        main(sys.argv[1])
\ No newline at end of file
@@ -0,0 +1,135 @@
+# image_io.py
+# Low-copy page loading for large invoice scans.
+#
+# The old path (PIL open -> exif_transpose -> convert("RGB") -> np.array -> cvtColor) kept up to
+# five full-resolution copies alive. Here a page is decoded exactly once, straight to BGR, into
+# one buffer:
+#   - EXIF orientation is read from the header only and applied as a numpy view (flip/rot90)
+#   - the model gets its own small, already letterbox-sized copy (it resizes to imgsz anyway)
+#   - crops are sliced from the oriented view and only the crop itself is copied
+#   - if the full-resolution buffer would exceed the per-request memory budget, the page is
+#     decoded at 1/2, 1/4 or 1/8 scale. Only JPEG gets this for free (libjpeg DCT scaling, so
+#     the big buffer never exists); OpenCV decodes PNG/TIFF/BMP at full resolution and then
+#     shrinks, so for those the budget bounds the buffer that is kept, not the decode peak.
+#     decoded_nbytes() reports both, so callers can account for the transient copy.
+
+import io
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+EXIF_ORIENTATION = 274
+MEM_BUDGET_MB    = 192     # default per-request budget for the kept page buffer (decode peak too, JPEG only)
+REDUCED_FLAGS    = {1: cv2.IMREAD_COLOR,
+                    2: cv2.IMREAD_REDUCED_COLOR_2,
+                    4: cv2.IMREAD_REDUCED_COLOR_4,
+                    8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def orient_view(a, orientation):
+    """Apply an EXIF orientation (same semantics as PIL.ImageOps.exif_transpose) as a view."""
+    if orientation == 2:
+        return a[:, ::-1]
+    if orientation == 3:
+        return a[::-1, ::-1]
+    if orientation == 4:
+        return a[::-1]
+    if orientation == 5:
+        return a.swapaxes(0, 1)
+    if orientation == 6:
+        return np.rot90(a, -1)
+    if orientation == 7:
+        return a.swapaxes(0, 1)[::-1, ::-1]
+    if orientation == 8:
+        return np.rot90(a, 1)
+    return a
+
+def _is_bytes(src):
+    return isinstance(src, (bytes, bytearray, memoryview))
+
+def _header(src):
+    """(width, height, orientation, format) without decoding pixels."""
+    with Image.open(io.BytesIO(src) if _is_bytes(src) else src) as im:
+        return im.width, im.height, im.getexif().get(EXIF_ORIENTATION, 1), im.format
+
+def page_shape(src):
+    """(h, w) of the upright page, from the header only."""
+    w, h, orientation, _ = _header(src)
+    return (w, h) if orientation in (5, 6, 7, 8) else (h, w)
+
+def _reduction(w, h, mem_budget_mb):
+    for r in (1, 2, 4, 8):
+        if (w // r) * (h // r) * 3 <= mem_budget_mb * 2**20:
+            return r
+    return 8
+
+def decoded_nbytes(src, mem_budget_mb=MEM_BUDGET_MB):
+    """(kept, peak) bytes of load_page(src, mem_budget_mb), from the header only.
+
+    ``kept`` is the page buffer; ``peak`` also counts the full-resolution buffer that non-JPEG
+    formats go through while a reduced decode is shrunk.
+    """
+    w, h, _, fmt = _header(src)
+    r = _reduction(w, h, mem_budget_mb)
+    kept = (w // r) * (h // r) * 3
+    return kept, kept if r == 1 or fmt == "JPEG" else kept + w * h * 3
+
+class Page:
+    """One decoded page: a single BGR buffer in stored orientation plus its EXIF orientation.
+
+    ``scale`` is the decode reduction (1, 2, 4 or 8); multiply coordinates by it to get back
+    to the original file's pixel grid.
+    """
+    def __init__(self, raw, orientation=1, scale=1):
+        self.raw = raw
+        self.orientation = orientation
+        self.scale = scale
+
+    @property
+    def view(self):
+        return orient_view(self.raw, self.orientation)
+
+    @property
+    def shape(self):
+        return self.view.shape
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes
+
+    def inference_input(self, imgsz):
+        """Contiguous oriented BGR copy with the long side <= imgsz, and the (fx, fy) factors
+        mapping its coordinates back onto ``view``."""
+        h, w = self.raw.shape[:2]
+        r = imgsz / max(h, w)
+        # resize before orienting: cv2 would copy a flipped/transposed view at full size first
+        small = cv2.resize(self.raw, (round(w * r), round(h * r)), interpolation=cv2.INTER_AREA) if r < 1 else self.raw
+        small = np.ascontiguousarray(orient_view(small, self.orientation))
+        vh, vw = self.shape[:2]
+        return small, (vw / small.shape[1], vh / small.shape[0])
+
+    def crop(self, box, pad=8):
+        """Padded crop of ``view`` (xyxy in view coordinates) as its own small contiguous array."""
+        v = self.view
+        h, w = v.shape[:2]
+        x1, y1, x2, y2 = map(int, box)
+        x1 = max(0, x1 - pad); y1 = max(0, y1 - pad)
+        x2 = min(w, x2 + pad); y2 = min(h, y2 + pad)
+        return np.ascontiguousarray(v[y1:y2, x1:x2])
+
+    def release(self):
+        self.raw = None
+
+def load_page(src, mem_budget_mb=MEM_BUDGET_MB):
+    """Decode an image file path or encoded bytes into a Page, honouring the memory budget."""
+    w, h, orientation, _ = _header(src)
+    r = _reduction(w, h, mem_budget_mb)
+    flags = REDUCED_FLAGS[r] | cv2.IMREAD_IGNORE_ORIENTATION
+    if _is_bytes(src):
+        raw = cv2.imdecode(np.frombuffer(src, np.uint8), flags)
+    else:
+        raw = cv2.imread(str(Path(src)), flags)
+    if raw is None:
+        raise ValueError(f"Could not decode image: {'<bytes>' if _is_bytes(src) else src}")
+    return Page(raw, orientation, r)
@@ -0,0 +1,146 @@
+# logo_gallery.py
+# Hot-reloadable logo gallery for long-running workers.
+#
+#   gallery = LogoGallery("logos").start()     # polls the directory in a background thread
+#   snap = gallery.snapshot()                  # immutable: use it for one whole request
+#   name, score = identify_logo(crop, snap, orb, cache)
+#
+# Each snapshot is a tuple of (name, bgr, descriptors) entries -- the same shape
+# load_gallery() returns -- plus a ``version``: a content hash of the gallery files, stable
+# across restarts, which CropCache uses for invalidation. A rescan only decodes files whose
+# (mtime, size) changed, builds the next snapshot off to the side and publishes it with a
+# single reference assignment, so in-flight identifications keep the snapshot they started
+# with and never wait on a reload.
+
+import hashlib, threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from pipeline_metrics import get_metrics
+
+POLL_SECONDS = 2.0
+ORB_FEATURES = 1500
+
+def load_logo(path, orb):
+    """(name, bgr, descriptors) for one logo file, or None if ORB finds no features."""
+    img = Image.open(path).convert("RGB")
+    img = ImageOps.exif_transpose(img)
+    g = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+    ggray = cv2.cvtColor(g, cv2.COLOR_BGR2GRAY)
+    kps, des = orb.detectAndCompute(ggray, None)
+    if des is None:
+        return None
+    return (Path(path).name, g, des)
+
+class GallerySnapshot(tuple):
+    """Immutable gallery entries plus the version they correspond to."""
+    def __new__(cls, entries, version, generation=0):
+        self = super().__new__(cls, entries)
+        self.version = version
+        self.generation = generation
+        return self
+
+class LogoGallery:
+    def __init__(self, logos_dir, poll_seconds=POLL_SECONDS):
+        self.logos_dir = Path(logos_dir)
+        self.poll_seconds = poll_seconds
+        self._orb = cv2.ORB_create(nfeatures=ORB_FEATURES)   # only used by the reload path
+        self._files = {}     # name -> (stat key, sha1 of file bytes, entry or None)
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._snap = GallerySnapshot((), "")
+        self.reload()
+        if not self._snap:
+            raise RuntimeError("No valid logos in gallery")
+
+    @property
+    def version(self):
+        return self._snap.version
+
+    def snapshot(self):
+        return self._snap
+
+    def reload(self):
+        """Rescan the directory; apply adds/replacements/removals as one new snapshot.
+
+        Returns True if the gallery changed.
+        """
+        with self._reload_lock:
+            seen, changed = {}, False
+            for p in sorted(self.logos_dir.glob("*")):
+                if not p.is_file() or p.name.startswith("."):
+                    continue
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                key = (st.st_mtime_ns, st.st_size)
+                old = self._files.get(p.name)
+                if old is not None and old[0] == key:
+                    seen[p.name] = old
+                    continue
+                try:
+                    data = p.read_bytes()
+                    entry = load_logo(p, self._orb)
+                except Exception as e:
+                    # half-written or not an image: keep any previous entry, retry on next change
+                    print(f"[Gallery] skip {p.name}: {e}")
+                    seen[p.name] = (key, old[1], old[2]) if old else (key, None, None)
+                    continue
+                sha = hashlib.sha1(data).hexdigest()
+                if old is None or old[1] != sha:
+                    changed = True
+                    print(f"[Gallery] {'add' if old is None else 'replace'} {p.name}")
+                seen[p.name] = (key, sha, entry)
+            for name in self._files.keys() - seen.keys():
+                changed = True
+                print(f"[Gallery] remove {name}")
+            self._files = seen
+            if not changed and self._snap:
+                return False
+
+            h = hashlib.sha1()
+            entries = []
+            for name in sorted(seen):
+                _, sha, entry = seen[name]
+                if entry is None:
+                    continue
+                h.update(f"{name}:{sha}\n".encode())
+                entries.append(entry)
+            if not entries:
+                print("[Gallery] warning: gallery is empty")
+            self._snap = GallerySnapshot(entries, h.hexdigest(), self._snap.generation + 1)
+            m = get_metrics()
+            m.set_gauge("gallery_size", len(entries))
+            m.set_gauge("gallery_generation", self._snap.generation)
+            return True
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.reload()
+            except Exception as e:   # never let the watcher die
+                print(f"[Gallery] reload failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="gallery-watch")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -13,6 +13,8 @@ OUT_DIR  = ROOT / "data"
 N_TRAIN = 2000
 N_VAL   = 300
 IM_SIZE = 1600     # synth canvas size (square simplifies scaling)
+RECT    = False    # True: keep each background's page aspect ratio, long side = IM_SIZE
+                   #       (pair with RECT_TRAIN in train_yolo.py / rectangular inference)
 
 random.seed(1337)
 
@@ -67,6 +69,12 @@ def place_logo(canvas: Image.Image, L: Image.Image):
     cy = (y + L.height/2) / ch
     return cx, cy, L.width/cw, L.height/ch
 
+def canvas_size(bg: Image.Image):
+    if not RECT:
+        return IM_SIZE, IM_SIZE
+    r = IM_SIZE / max(bg.width, bg.height)
+    return max(1, round(bg.width * r)), max(1, round(bg.height * r))
+
 def make_split(split, n):
     (OUT_DIR / "images" / split).mkdir(parents=True, exist_ok=True)
     (OUT_DIR / "labels" / split).mkdir(parents=True, exist_ok=True)
@@ -76,15 +84,16 @@ def make_split(split, n):
 
     for _ in trange(n, desc=f"gen {split}"):
         bg = random.choice(bkgs).copy()
-        # square canvas; fit background
-        canvas = Image.new("RGBA", (IM_SIZE, IM_SIZE), (255,255,255,255))
-        bg_r = bg.resize((IM_SIZE, IM_SIZE), Image.BICUBIC)
+        # square canvas (or page-shaped with RECT); fit background
+        cw, ch = canvas_size(bg)
+        canvas = Image.new("RGBA", (cw, ch), (255,255,255,255))
+        bg_r = bg.resize((cw, ch), Image.BICUBIC)
         canvas.alpha_composite(bg_r)
 
         # paste 1–2 logos
         boxes = []
         for __ in range(1 if random.random()<0.85 else 2):
-            L = random_logo_transform(random.choice(logos), IM_SIZE, IM_SIZE)
+            L = random_logo_transform(random.choice(logos), cw, ch)
             boxes.append(place_logo(canvas, L))
 
         # light page noise
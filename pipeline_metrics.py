@@ -0,0 +1,276 @@
+# pipeline_metrics.py
+# Lightweight per-stage latency instrumentation for the detection pipeline.
+#
+#   from pipeline_metrics import get_metrics
+#   m = get_metrics()
+#   with m.request(source="invoice1.jpg"):
+#       with m.stage("decode"):
+#           ...
+#       m.inc("boxes", 3)
+#
+# Disabled by default; get_metrics() then returns a no-op object whose stage()/request()
+# hand back one shared nullcontext, so instrumented code costs a method call per stage.
+#
+# Environment (read once by get_metrics()):
+#   LOGO_METRICS=1                 enable
+#   LOGO_METRICS_JSONL=path        append one JSON line per request (stage timings + counts)
+#   LOGO_METRICS_PORT=9108         serve Prometheus text format on http://127.0.0.1:PORT/metrics
+#   LOGO_METRICS_PROFILE=path      run the sampling profiler, write collapsed stacks on exit
+#   LOGO_METRICS_PROFILE_HZ=100    sampling rate
+
+import atexit, json, os, sys, threading, time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX  = "logo"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        for i, b in enumerate(self.buckets):
+            if v <= b:
+                self.counts[i] += 1
+                break
+        self.sum += v
+        self.count += 1
+
+class SamplingProfiler:
+    """Poor man's sampling profiler: snapshot every thread's stack at a fixed rate.
+
+    Stacks are kept in collapsed form ("a;b;c count"), which flamegraph.pl / speedscope read.
+    """
+    def __init__(self, hz=100):
+        self.interval = 1.0 / hz
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="metrics-profiler")
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(parts))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, path=None):
+        self._stop.set()
+        self._thread.join()
+        if path:
+            with open(path, "w") as f:
+                for stack, n in self.stacks.most_common():
+                    f.write(f"{stack} {n}\n")
+
+class PeakRSS:
+    """Sample RSS of this process + USS of its children in the background, keep the max.
+
+    Children (forked dataloader workers) share copy-on-write pages with the parent, so only
+    their unique memory is added; summing their RSS would count the shared pages once per child.
+    Needs psutil, imported on first sample so the rest of this module stays stdlib-only.
+    """
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        import psutil
+        me = psutil.Process()
+        rss = me.memory_info().rss
+        for c in me.children(recursive=True):
+            try:
+                rss += c.memory_full_info().uss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+class Metrics:
+    def __init__(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+        self.hist = defaultdict(Histogram)   # stage -> Histogram
+        self.counters = Counter()
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._server = None
+        self._profiler = None
+        self._profile_path = None
+
+    # ---- recording ----
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    def observe(self, name, seconds):
+        """Record a stage duration measured elsewhere (e.g. a batch step split across pages)."""
+        with self._lock:
+            self.hist[name].observe(seconds)
+        rec = getattr(self._local, "record", None)
+        if rec is not None:
+            rec["stages"][name] = rec["stages"].get(name, 0.0) + seconds
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+        rec = getattr(self._local, "record", None)
+        if rec is not None:
+            rec["counts"][name] = rec["counts"].get(name, 0) + n
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def request(self, prior=0.0, **fields):
+        """Group the stages of one request; writes one JSON line when it ends.
+
+        ``prior``: seconds already spent on this request before it was opened (e.g. decode and
+        a share of batch inference, recorded with observe()); counted in the request total.
+        """
+        rec = dict(ts=time.time(), **fields, stages={}, counts={})
+        self._local.record = rec
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            self._local.record = None
+            rec["total"] = prior + time.perf_counter() - t0
+            with self._lock:
+                self.hist["total"].observe(rec["total"])
+                if self.jsonl_path:
+                    with open(self.jsonl_path, "a") as f:
+                        f.write(json.dumps(rec) + "\n")
+
+    # ---- export ----
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            name = f"{PREFIX}_stage_seconds"
+            lines += [f"# HELP {name} Per-stage latency of the detection pipeline.",
+                      f"# TYPE {name} histogram"]
+            for stage, h in sorted(self.hist.items()):
+                acc = 0
+                for b, c in zip(h.buckets, h.counts):
+                    acc += c
+                    le = "+Inf" if b == float("inf") else repr(b)
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {acc}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+            for k, v in sorted(self.counters.items()):
+                lines += [f"# TYPE {PREFIX}_{k}_total counter", f"{PREFIX}_{k}_total {v}"]
+            for k, v in sorted(self.gauges.items()):
+                lines += [f"# TYPE {PREFIX}_{k} gauge", f"{PREFIX}_{k} {v}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics-http").start()
+        return self._server
+
+    def start_profiler(self, path, hz=100):
+        self._profile_path = path
+        self._profiler = SamplingProfiler(hz).start()
+
+    def close(self):
+        if self._profiler is not None:
+            self._profiler.stop(self._profile_path)
+            self._profiler = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+class NullMetrics:
+    """Disabled metrics: every hook is a no-op."""
+    _ctx = nullcontext()
+
+    def stage(self, name):
+        return self._ctx
+
+    def request(self, prior=0.0, **fields):
+        return self._ctx
+
+    def observe(self, name, seconds):
+        pass
+
+    def inc(self, name, n=1):
+        pass
+
+    def set_gauge(self, name, value):
+        pass
+
+    def prometheus_text(self):
+        return ""
+
+    def close(self):
+        pass
+
+_metrics = None
+
+def get_metrics():
+    """Process-wide metrics object, configured from the environment on first use."""
+    global _metrics
+    if _metrics is None:
+        if os.environ.get("LOGO_METRICS", "0") in ("", "0", "false", "no"):
+            _metrics = NullMetrics()
+        else:
+            _metrics = Metrics(jsonl_path=os.environ.get("LOGO_METRICS_JSONL"))
+            port = os.environ.get("LOGO_METRICS_PORT")
+            if port:
+                _metrics.serve(int(port))
+            profile = os.environ.get("LOGO_METRICS_PROFILE")
+            if profile:
+                _metrics.start_profiler(profile, int(os.environ.get("LOGO_METRICS_PROFILE_HZ", "100")))
+            atexit.register(_metrics.close)
+    return _metrics
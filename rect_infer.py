@@ -0,0 +1,55 @@
+# rect_infer.py
+# Aspect-ratio-aware rectangular inference.
+#
+# Invoices are portrait A4/Letter (~1:1.41 / 1:1.29). Ultralytics predict already defaults to
+# rect=True: for a .pt model and a batch of same-shape images it letterboxes to the smallest
+# stride-aligned rectangle, so a single page is not padded to a square. It falls back to a
+# square imgsz x imgsz letterbox (~30% padding for A4) when a batch mixes shapes, and
+# exported/static-shape models always get their fixed input size.
+#
+# Here the input shape is picked per page: long side = imgsz, short side scaled by the page's
+# aspect ratio and rounded *up* to the model stride (the same shape ultralytics' auto
+# letterbox would pick for that page alone). Pages are grouped by that shape so every batch is
+# uniform. The gain is therefore for mixed-shape batches, which keep the per-page rectangle,
+# and for exported models, which get one fixed shape per bucket; single-page .pt inference
+# runs at the same shape as before.
+
+import math
+from collections import defaultdict
+
+DEFAULT_STRIDE = 32
+
+def model_stride(model):
+    try:
+        return int(max(model.model.stride))
+    except (AttributeError, TypeError):
+        return DEFAULT_STRIDE
+
+def rect_shape(h, w, imgsz, stride=DEFAULT_STRIDE):
+    """Stride-aligned (H, W) input shape with long side imgsz and the page's aspect ratio."""
+    long_side = math.ceil(imgsz / stride) * stride
+    r = long_side / max(h, w)
+    H = min(long_side, math.ceil(h * r / stride) * stride)
+    W = min(long_side, math.ceil(w * r / stride) * stride)
+    return H, W
+
+def padding_fraction(h, w, shape):
+    """Share of the (H, W) input that would be padding for an h x w page."""
+    H, W = shape
+    r = min(H / h, W / w)
+    return 1.0 - (h * r) * (w * r) / (H * W)
+
+def predict_rect(model, images, imgsz, batch=8, **kwargs):
+    """Run ``model`` over BGR arrays, grouped into same-shape batches; results in input order."""
+    stride = model_stride(model)
+    buckets = defaultdict(list)
+    for i, im in enumerate(images):
+        buckets[rect_shape(*im.shape[:2], imgsz, stride)].append(i)
+    out = [None] * len(images)
+    for shape, idx in buckets.items():
+        for k in range(0, len(idx), batch):
+            chunk = idx[k:k + batch]
+            res = model([images[i] for i in chunk], imgsz=list(shape), verbose=False, **kwargs)
+            for i, r in zip(chunk, res):
+                out[i] = r
+    return out
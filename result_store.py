@@ -0,0 +1,251 @@
+# result_store.py
+# Columnar detection results + packed crop archives for batch runs.
+#
+# Layout of a store directory:
+#   detections/part-<writer>-<seq>.parquet   one row per detected box (box_index -1 = no logo)
+#   crops/<writer>.pack                      encoded crops, back to back, append-only
+#   crops/<writer>.idx                       fixed-size records: offset, length, h, w, fmt, ch
+#
+# A crop id is its record number in <writer>.idx, so (crop_archive, crop_id) in a detection
+# row addresses any crop with one pread of the index and one of the pack. Each process writes
+# under its own writer name (shard workers use w0, w1, ...), so nothing needs locking across
+# processes, and reopening a writer appends to it.
+#
+# Crops are encoded and written by a background thread (cv2 releases the GIL while
+# encoding); ids are handed out at submit time so detection rows can reference them at once.
+# Detection rows are buffered and written as a Parquet part every FLUSH_ROWS rows or, via
+# add()/maybe_flush(), once FLUSH_SECONDS have passed, so a writer that dies without close()
+# loses at most that much. A part is only written after the crops its rows point at.
+# Formats: "png" (zlib level 1 rather than cv2's default 3), "jpg" (quality 95), "raw"
+# (no encode at all, fastest, ~3 bytes/pixel).
+
+import os, queue, struct, threading, time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+IDX_RECORD  = struct.Struct("<QIHHBB2x")   # offset, length, h, w, fmt, channels
+FORMATS     = {"raw": 0, "png": 1, "jpg": 2}
+FLUSH_ROWS  = 50_000
+FLUSH_SECONDS = 30.0
+QUEUE_ITEMS = 256
+
+SCHEMA = pa.schema([
+    ("source", pa.string()),
+    ("box_index", pa.int32()),
+    ("x1", pa.float32()), ("y1", pa.float32()), ("x2", pa.float32()), ("y2", pa.float32()),
+    ("conf", pa.float32()),
+    ("match", pa.string()),
+    ("score", pa.float32()),
+    ("crop_archive", pa.string()),
+    ("crop_id", pa.int64()),
+    ("t_decode", pa.float32()), ("t_resize", pa.float32()), ("t_inference", pa.float32()),
+    ("t_identify", pa.float32()),
+    ("ts", pa.float64()),
+])
+
+def _encode(crop, fmt):
+    if fmt == "raw":
+        return np.ascontiguousarray(crop).tobytes()
+    if fmt == "png":
+        ok, buf = cv2.imencode(".png", crop, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    else:
+        ok, buf = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise ValueError(f"Could not encode crop as {fmt}")
+    return buf.tobytes()
+
+class CropArchiveWriter:
+    """Append-only crop pack with an offset index, written by a background thread."""
+    def __init__(self, pack_path, fmt="png"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown crop format {fmt!r}; expected one of {sorted(FORMATS)}")
+        self.fmt = fmt
+        self.pack_path = Path(pack_path)
+        self.idx_path = self.pack_path.with_suffix(".idx")
+        self.pack_path.parent.mkdir(parents=True, exist_ok=True)
+        self._pack = open(self.pack_path, "ab")
+        self._idx = open(self.idx_path, "ab")
+        self._recover()
+        self._next_id = self._idx.tell() // IDX_RECORD.size
+        self._q = queue.Queue(maxsize=QUEUE_ITEMS)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True, name="crop-writer")
+        self._thread.start()
+
+    def _recover(self):
+        """Drop a torn tail left by a crash: partial index record, unindexed pack bytes."""
+        n = os.path.getsize(self.idx_path) // IDX_RECORD.size
+        self._idx.truncate(n * IDX_RECORD.size)
+        end = 0
+        if n:
+            with open(self.idx_path, "rb") as f:
+                f.seek((n - 1) * IDX_RECORD.size)
+                off, length, *_ = IDX_RECORD.unpack(f.read(IDX_RECORD.size))
+            end = off + length
+        self._pack.truncate(end)
+        self._pack.seek(0, os.SEEK_END)
+        self._idx.seek(0, os.SEEK_END)
+
+    def _run(self):
+        while True:
+            crop = self._q.get()
+            if crop is None:
+                self._q.task_done()
+                break
+            off = self._pack.tell()
+            try:
+                data = _encode(crop, self.fmt)
+                self._pack.write(data)
+                self._pack.flush()   # pack bytes land before the index record that points at them
+                h, w = crop.shape[:2]
+                ch = 1 if crop.ndim == 2 else crop.shape[2]
+                rec = IDX_RECORD.pack(off, len(data), h, w, FORMATS[self.fmt], ch)
+            except Exception as e:   # surfaced on the next add()/close()
+                self._error = e
+                rec = IDX_RECORD.pack(off, 0, 0, 0, FORMATS[self.fmt], 0)   # keep ids aligned
+            self._idx.write(rec)
+            self._idx.flush()
+            self._q.task_done()
+
+    def add(self, crop):
+        """Queue a crop; returns its id right away."""
+        if self._error is not None:
+            raise self._error
+        cid = self._next_id
+        self._next_id += 1
+        self._q.put(crop)
+        return cid
+
+    def sync(self):
+        """Block until every queued crop is in the pack and the index."""
+        self._q.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._q.put(None)
+        self._thread.join()
+        self._thread = None
+        self._pack.close()
+        self._idx.close()
+        if self._error is not None:
+            raise self._error
+
+class CropArchiveReader:
+    """Random access to crops of one archive; safe to use while a writer is appending."""
+    def __init__(self, pack_path):
+        self.pack_path = Path(pack_path)
+        self._pack = os.open(self.pack_path, os.O_RDONLY)
+        self._idx = os.open(self.pack_path.with_suffix(".idx"), os.O_RDONLY)
+
+    def __len__(self):
+        return os.fstat(self._idx).st_size // IDX_RECORD.size
+
+    def record(self, crop_id):
+        if crop_id < 0:   # -1 marks detection rows without a crop
+            raise IndexError(crop_id)
+        rec = os.pread(self._idx, IDX_RECORD.size, crop_id * IDX_RECORD.size)
+        if len(rec) < IDX_RECORD.size:
+            raise IndexError(crop_id)
+        return IDX_RECORD.unpack(rec)
+
+    def raw(self, crop_id):
+        """Encoded bytes of a crop (PNG/JPEG file contents, or raw pixels)."""
+        off, length, *_ = self.record(crop_id)
+        return os.pread(self._pack, length, off)
+
+    def __getitem__(self, crop_id):
+        off, length, h, w, fmt, ch = self.record(crop_id)
+        if length == 0:
+            raise ValueError(f"Crop {crop_id} failed to encode when it was written")
+        data = os.pread(self._pack, length, off)
+        if fmt == FORMATS["raw"]:
+            return np.frombuffer(data, np.uint8).reshape((h, w) if ch == 1 else (h, w, ch))
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+    def close(self):
+        os.close(self._pack)
+        os.close(self._idx)
+
+class ResultStoreWriter:
+    """Sink for detect_and_identify batch runs: detection rows -> Parquet, crops -> archive."""
+    def __init__(self, store_dir, writer="main", crop_format="png", flush_rows=FLUSH_ROWS,
+                 flush_seconds=FLUSH_SECONDS):
+        self.store_dir = Path(store_dir)
+        self.writer = writer
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._t_flush = time.monotonic()
+        (self.store_dir / "detections").mkdir(parents=True, exist_ok=True)
+        self.crops = CropArchiveWriter(self.store_dir / "crops" / f"{writer}.pack", crop_format)
+        self._rows = {f.name: [] for f in SCHEMA}
+        parts = (self.store_dir / "detections").glob(f"part-{writer}-*.parquet")
+        self._seq = max((int(p.stem.rsplit("-", 1)[1]) + 1 for p in parts), default=0)
+
+    def add(self, source, box_index=-1, box=None, conf=None, match=None, score=None, crop=None,
+            timings=None):
+        """Record one detection (or, with box_index -1, a page without any); returns the crop id."""
+        crop_id = self.crops.add(crop) if crop is not None else -1
+        x1, y1, x2, y2 = box if box is not None else (None,) * 4
+        t = timings or {}
+        row = dict(source=str(source), box_index=box_index, x1=x1, y1=y1, x2=x2, y2=y2, conf=conf,
+                   match=match, score=score, crop_archive=self.writer if crop_id >= 0 else None,
+                   crop_id=crop_id, t_decode=t.get("decode"), t_resize=t.get("resize"),
+                   t_inference=t.get("inference"), t_identify=t.get("identify"), ts=time.time())
+        for k, v in row.items():
+            self._rows[k].append(None if v is None else (float(v) if isinstance(v, np.floating) else v))
+        if len(self._rows["source"]) >= self.flush_rows:
+            self.flush()
+        else:
+            self.maybe_flush()
+        return crop_id
+
+    def maybe_flush(self):
+        """Flush if rows have been buffered for flush_seconds; cheap to call after every batch."""
+        if self._rows["source"] and time.monotonic() - self._t_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self._t_flush = time.monotonic()
+        if not self._rows["source"]:
+            return
+        self.crops.sync()   # rows never reference crops that are not on disk yet
+        table = pa.table(self._rows, schema=SCHEMA)
+        path = self.store_dir / "detections" / f"part-{self.writer}-{self._seq:05d}.parquet"
+        tmp = path.with_name(f".{path.name}.tmp")   # dot-prefixed: ignored by dataset readers
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)   # readers never see a half-written part
+        self._seq += 1
+        self._rows = {f.name: [] for f in SCHEMA}
+
+    def close(self):
+        self.flush()
+        self.crops.close()
+
+class ResultStore:
+    """Read side: the detections table plus random access to any crop."""
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self._readers = {}
+
+    def detections(self, columns=None, filters=None):
+        return pq.read_table(self.store_dir / "detections", columns=columns, filters=filters)
+
+    def crop(self, crop_archive, crop_id):
+        if crop_archive is None:
+            raise IndexError("detection row has no crop (crop_archive is None)")
+        r = self._readers.get(crop_archive)
+        if r is None:
+            r = self._readers[crop_archive] = CropArchiveReader(self.store_dir / "crops" / f"{crop_archive}.pack")
+        return r[int(crop_id)]
+
+    def close(self):
+        for r in self._readers.values():
+            r.close()
+        self._readers.clear()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Sharded multi-process detect_and_identify for large backlogs
+
+Each worker process takes a free slot index, pins a fixed torch/OpenCV thread budget (and optionally a disjoint CPU
+set), loads the model, gallery and crop cache once, then pulls batches of pages from a shared
+queue. Results are merged into one dict / JSON file, and a per-worker utilization report
+shows how busy each worker was and how much CPU it actually used.
+
+A page that cannot be decoded, or a batch whose inference raises, is recorded in the report's
+``failed`` map ({path: error}) and the run carries on; only a dead worker stops the run.
+
+Heavy imports (torch via ultralytics) happen inside the worker initializer, after the thread
+environment variables are set, so OpenMP/MKL pick up the budget.
+"""
+
+import argparse, json, os, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+_W = {}   # per-worker state, filled by _init_worker
+
+def plan_cpus(n_workers, threads):
+    """Disjoint CPU sets of ``threads`` cores per worker, or None where the OS can't pin."""
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * n_workers
+    cpus = sorted(os.sched_getaffinity(0))
+    if n_workers * threads > len(cpus):
+        print(f"[Shard] {n_workers}x{threads} threads > {len(cpus)} CPUs; not pinning")
+        return [None] * n_workers
+    return [cpus[i * threads:(i + 1) * threads] for i in range(n_workers)]
+
+def _init_worker(slots, cpu_sets, threads, cv_threads, cfg):
+    idx = slots.get()   # 0..n_workers-1; indexes cpu_sets, metrics port and store writer name
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    port = os.environ.get("LOGO_METRICS_PORT")
+    if port:  # one Prometheus endpoint per worker: base port + 1 + index
+        os.environ["LOGO_METRICS_PORT"] = str(int(port) + 1 + idx)
+    cpus = cpu_sets[idx]
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+
+    import cv2, torch
+    from ultralytics import YOLO
+    from crop_cache import CropCache
+    from logo_gallery import ORB_FEATURES, LogoGallery
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    cv2.setNumThreads(cv_threads)
+
+    store = None
+    if cfg["store_dir"]:
+        from multiprocessing.util import Finalize
+        from result_store import ResultStoreWriter
+        store = ResultStoreWriter(cfg["store_dir"], writer=f"w{idx}", crop_format=cfg["crop_format"])
+        Finalize(store, store.close, exitpriority=10)   # final flush on clean executor shutdown
+
+    gallery = LogoGallery(cfg["logos_dir"])
+    if cfg["watch"]:
+        gallery.start()
+    _W.update(
+        idx=idx, cpus=cpus, threads=threads, cfg=cfg,
+        model=YOLO(cfg["weights"]), gallery=gallery,
+        orb=cv2.ORB_create(nfeatures=ORB_FEATURES),
+        cache=CropCache(disk_path=cfg["cache_db"]), store=store,
+        t_ready=time.time(), cpu0=time.process_time(),
+    )
+
+def _run_chunk(paths):
+    from detect_and_identify import process_batch
+    cfg = _W["cfg"]
+    t0 = time.time()
+    errors = {}
+    try:
+        res = process_batch(paths, _W["model"], _W["gallery"], _W["orb"], cfg["out_dir"],
+                            cfg["mem_budget_mb"], _W["cache"], cfg["rect"], cfg["batch"], _W["store"],
+                            errors)
+    except Exception as e:   # not a single bad page: the chunk's results are lost, the run goes on
+        res = {}
+        errors.update((str(p), f"{type(e).__name__}: {e}") for p in paths if str(p) not in errors)
+    if _W["store"] is not None:   # bound what a killed worker loses: its finalizer never runs
+        _W["store"].maybe_flush()
+    t1 = time.time()
+    return dict(worker=_W["idx"], pid=os.getpid(), cpus=_W["cpus"], threads=_W["threads"],
+                t_ready=_W["t_ready"], t_start=t0, t_end=t1, n=len(paths),
+                cpu_s=time.process_time() - _W["cpu0"], results=res, errors=errors)
+
+def _chunks(img_paths, batch, rect, imgsz):
+    if rect:  # keep same-shape pages together so each chunk is one forward pass
+        from image_io import page_shape
+        from rect_infer import rect_shape
+        img_paths = sorted(img_paths, key=lambda p: rect_shape(*page_shape(p), imgsz))
+    return [img_paths[k:k + batch] for k in range(0, len(img_paths), batch)]
+
+def run_sharded(img_paths, n_workers=None, threads=None, cv_threads=1, pin=False,
+                weights="runs/detect/train/weights/best.pt", logos_dir="logos", out_dir="out",
+                mem_budget_mb=None, cache_db=None, watch=False, rect=None, batch=None,
+                store_dir=None, crop_format="png"):
+    """Process ``img_paths`` across worker processes; returns (merged results, report).
+
+    With store_dir, every worker appends to the same result store under its own writer name
+    (detections part files + crops/w<i>.pack), so the store reads back as one table.
+    """
+    from detect_and_identify import INF_BATCH, INF_IMGSZ, RECT_INFER
+    from image_io import MEM_BUDGET_MB
+
+    n_cpu = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    n_workers = n_workers or max(1, n_cpu // 4)
+    threads = threads or max(1, n_cpu // n_workers)
+    rect = RECT_INFER if rect is None else rect
+    batch = batch or INF_BATCH
+    cfg = dict(weights=weights, logos_dir=logos_dir, out_dir=out_dir, watch=watch, cache_db=cache_db,
+               mem_budget_mb=mem_budget_mb or MEM_BUDGET_MB, rect=rect, batch=batch,
+               store_dir=store_dir, crop_format=crop_format)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    cpu_sets = plan_cpus(n_workers, threads) if pin else [None] * n_workers
+    chunks = _chunks(list(img_paths), batch, rect, INF_IMGSZ)
+    print(f"[Shard] {len(img_paths)} pages | {len(chunks)} batches | {n_workers} workers x {threads} threads "
+          f"| OpenCV threads {cv_threads} | pinned: {pin and cpu_sets[0] is not None}")
+
+    ctx = mp.get_context("spawn")   # fresh interpreters: no inherited torch thread pools
+    slots = ctx.Queue()
+    for i in range(n_workers):
+        slots.put(i)
+    merged, failed, per_worker = {}, {}, {}
+    t0 = time.time()
+    # A worker that dies (OOM kill) or whose initializer raises (bad weights, empty gallery)
+    # breaks the executor: result() raises BrokenProcessPool instead of the run hanging, and
+    # the chunks still queued are cancelled rather than run before the error surfaces.
+    with ProcessPoolExecutor(n_workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(slots, cpu_sets, threads, cv_threads, cfg)) as pool:
+        futures = [pool.submit(_run_chunk, c) for c in chunks]
+        try:
+            for fut in as_completed(futures):
+                r = fut.result()
+                merged.update(r.pop("results"))
+                failed.update(r.pop("errors"))
+                w = per_worker.setdefault(r["worker"], dict(worker=r["worker"], pid=r["pid"], cpus=r["cpus"],
+                                                            threads=r["threads"], t_ready=r["t_ready"],
+                                                            images=0, batches=0, busy_s=0.0))
+                w["images"] += r["n"]
+                w["batches"] += 1
+                w["busy_s"] += r["t_end"] - r["t_start"]
+                w["t_end"] = r["t_end"]
+                w["cpu_s"] = r["cpu_s"]
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    # leaving the with-block shuts workers down cleanly, which runs their store flush finalizers
+    wall = time.time() - t0
+
+    workers = []
+    for w in sorted(per_worker.values(), key=lambda w: w["worker"]):
+        active = max(w.pop("t_end") - w.pop("t_ready"), 1e-9)
+        w["utilization"] = w["busy_s"] / active                       # share of time on a batch
+        w["cpu_utilization"] = w["cpu_s"] / (active * w["threads"])   # share of its core budget
+        w["images_per_s"] = w["images"] / active
+        workers.append(w)
+    report = dict(pages=len(img_paths), wall_s=wall, images_per_s=len(img_paths) / wall if wall else 0.0,
+                  n_workers=n_workers, threads_per_worker=threads, cv_threads=cv_threads, pinned=pin,
+                  workers=workers, failed=failed)
+
+    print(f"{'worker':>6} {'pid':>8} {'images':>7} {'img/s':>7} {'busy':>6} {'cpu':>6}  cpus")
+    for w in workers:
+        print(f"{w['worker']:>6} {w['pid']:>8} {w['images']:>7} {w['images_per_s']:>7.2f} "
+              f"{w['utilization']:>6.0%} {w['cpu_utilization']:>6.0%}  {w['cpus'] or '-'}")
+    for p, err in sorted(failed.items()):
+        print(f"[Shard] failed {p}: {err}")
+    print(f"[Shard] total {len(img_paths)} pages in {wall:.1f}s ({report['images_per_s']:.2f} img/s)"
+          f"{f' | {len(failed)} failed' if failed else ''}")
+    return merged, report
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("images", nargs="+", help="image files or glob patterns")
+    ap.add_argument("--workers", type=int, default=None, help="default: CPUs / 4")
+    ap.add_argument("--threads", type=int, default=None, help="torch threads per worker (default: CPUs / workers)")
+    ap.add_argument("--cv-threads", type=int, default=1, help="OpenCV threads per worker")
+    ap.add_argument("--pin", action="store_true", help="pin each worker to its own CPU set (Linux)")
+    ap.add_argument("--weights", default="runs/detect/train/weights/best.pt")
+    ap.add_argument("--logos", default="logos")
+    ap.add_argument("--out", default="out")
+    ap.add_argument("--cache-db", default=None)
+    ap.add_argument("--watch", action="store_true", help="hot-reload the logo gallery")
+    ap.add_argument("--store", default=None, help="write Parquet detections + packed crops to this dir")
+    ap.add_argument("--crop-format", default="png", choices=["png", "jpg", "raw"])
+    ap.add_argument("--results", default=None, help="write merged results JSON here")
+    ap.add_argument("--report", default=None, help="write the utilization report JSON here")
+    args = ap.parse_args()
+
+    import glob
+    paths = [p for pat in args.images for p in (sorted(glob.glob(pat)) or [pat])]
+    merged, report = run_sharded(paths, args.workers, args.threads, args.cv_threads, args.pin,
+                                 args.weights, args.logos, args.out, cache_db=args.cache_db, watch=args.watch,
+                                 store_dir=args.store, crop_format=args.crop_format)
+    if args.results:
+        def entry(o, n, s):
+            if isinstance(o, tuple):   # store mode: crop ids only mean something per worker archive
+                return dict(crop_archive=o[0], crop_id=o[1], match=n, score=s)
+            return dict(crop=str(o), match=n, score=s)
+        Path(args.results).write_text(json.dumps(
+            {src: [entry(*e) for e in saved] for src, saved in merged.items()}, indent=2))
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 # train_yolo.py
 # Optimized for Apple Silicon (M1/M2/M3/M4) + MPS with verbose device info.
+# On CPU, workers/batch/cache are auto-tuned (see autotune_train.py) unless AUTOTUNE_CPU = False.
 
 from ultralytics import YOLO
 import torch
 import platform
 
+DATA = "yolo_logo.yaml"
+WEIGHTS = "yolov8n.pt"   # change to 'yolov8s.pt' for more accuracy
+IMGSZ = 1024
+AUTOTUNE_CPU = True
+RECT_TRAIN = False   # rectangular (aspect-ratio) batches; matches RECT synth data + rect inference.
+                     # Ultralytics disables mosaic and shuffling in rect mode.
+
 # ---- Hardware/device detection ----
 def pick_device(verbose=True):
     if torch.backends.mps.is_built() and torch.backends.mps.is_available():
@@ -23,19 +31,31 @@ def pick_device(verbose=True):
 device = pick_device(verbose=True)
 is_mac = (platform.system() == "Darwin")
 workers = 2 if (device == "mps" and is_mac) else 4
+batch = 16
+cache = True        # speeds up macOS I/O
+
+tuned = None
+if device == "cpu" and AUTOTUNE_CPU:
+    from autotune_train import autotune, save_report
+    tuned = autotune(DATA, WEIGHTS, IMGSZ)
+    if tuned["workers"] is not None:   # None: nothing measured fit in memory, keep the defaults
+        workers, batch, cache = tuned["workers"], tuned["batch"], tuned["cache"]
 
-print(f"[Config] Device: {device} | Dataloader workers: {workers} | macOS: {is_mac}")
+print(f"[Config] Device: {device} | Dataloader workers: {workers} | Batch: {batch} | Cache: {cache} | macOS: {is_mac}")
 print(f"[Config] PyTorch: {torch.__version__} | Python: {platform.python_version()} ({platform.machine()})")
 
 # ---- Load YOLO model ----
-model = YOLO("yolov8n.pt")   # change to 'yolov8s.pt' for more accuracy
+model = YOLO(WEIGHTS)
+if tuned is not None:
+    # write the chosen settings + measurements into the run dir as soon as it exists
+    model.add_callback("on_pretrain_routine_start", lambda trainer: save_report(tuned, trainer.save_dir))
 
 # ---- Train ----
 model.train(
-    data="yolo_logo.yaml",
+    data=DATA,
     epochs=40,
-    imgsz=1024,
-    batch=16,
+    imgsz=IMGSZ,
+    batch=batch,
     device=device,
     workers=workers,
     optimizer="AdamW",
@@ -47,6 +67,7 @@ model.train(
     fliplr=0.0,        # avoid flipping text/logos
     mosaic=0.7,
     mixup=0.1,
-    cache=True,        # speeds up macOS I/O
+    cache=cache,
+    rect=RECT_TRAIN,
     verbose=True       # YOLO prints per-batch info
 )
\ No newline at end of file